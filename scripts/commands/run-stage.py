@@ -5,137 +5,391 @@ Run-Stage Command Implementation
 A comprehensive command for managing the project build pipeline with dependency tracking.
 """
 
+import gzip
 import hashlib
 import json
 import os
+import pickle
 import subprocess
 import sys
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Read size used when hashing tracked files
+HASH_CHUNK_SIZE = 1 << 20
+
+# Per-stage dependency tracking state, relative to base_dir
+BUILD_STATE_FILE = ".build_state.json"
+
 
 class RunStage:
     def __init__(self):
         self.base_dir = Path(__file__).parent.parent.parent
+        self._input_cache = {}
+        self._log_lock = threading.Lock()
+        self._state = None
+        self._state_lock = threading.RLock()
+        self._defer_state_save = False
+
+    def log(self, message):
+        """Print a status line; safe to call from concurrently running stages."""
+        with self._log_lock:
+            print(message, flush=True)
+
+    def get_file_stamp(self, filepath):
+        """Get size and mtime stamp of a file for the fast change check."""
+        if not filepath.exists():
+            return None
+        stat = filepath.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
 
     def get_file_hash(self, filepath):
-        """Calculate MD5 hash of a file."""
+        """Calculate BLAKE2b hash of a file, reading it in chunks."""
         if not filepath.exists():
             return None
+        digest = hashlib.blake2b(digest_size=16)
         with open(filepath, "rb") as f:
-            return hashlib.md5(f.read()).hexdigest()
-
-    def save_hash(self, stage, file_hash):
-        """Save hash for dependency tracking."""
-        hash_file = self.base_dir / f"stages/{stage}/.last_{stage}_hash"
-        hash_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(hash_file, "w") as f:
-            f.write(file_hash)
-
-    def get_saved_hash(self, stage):
-        """Get saved hash for dependency tracking."""
-        hash_file = self.base_dir / f"stages/{stage}/.last_{stage}_hash"
-        if hash_file.exists():
-            with open(hash_file, "r") as f:
-                return f.read().strip()
-        return None
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load_state(self):
+        """Load the build state file once and keep it on the instance."""
+        # Stages running concurrently in run_all must share a single dict
+        with self._state_lock:
+            if self._state is None:
+                state_file = self.base_dir / BUILD_STATE_FILE
+                try:
+                    with open(state_file, "rb") as f:
+                        data = f.read()
+                    self._state = orjson.loads(data) if orjson else json.loads(data)
+                except (OSError, ValueError):
+                    self._state = {}
+            return self._state
+
+    def _save_state(self):
+        """Atomically write the build state file via a temporary file."""
+        with self._state_lock:
+            state = self._load_state()
+            if orjson:
+                content = orjson.dumps(state, option=orjson.OPT_INDENT_2)
+            else:
+                content = json.dumps(state, indent=2).encode("utf-8")
+
+            state_file = self.base_dir / BUILD_STATE_FILE
+            tmp_file = state_file.with_name(state_file.name + ".tmp")
+            with open(tmp_file, "wb") as f:
+                f.write(content)
+            os.replace(tmp_file, state_file)
+
+    def _commit_state(self):
+        """Save the build state, unless run_all batches it into one write."""
+        if not self._defer_state_save:
+            self._save_state()
+
+    def get_stage_state(self, stage):
+        """Get saved dependency tracking state of a stage."""
+        return self._load_state().get(stage, {})
+
+    def record_stage(self, stage, input_file, input_hash, input_stamp, **outputs):
+        """
+        Record a completed stage in the build state.
+
+        Args:
+            stage: Stage name
+            input_file: File the stage depends on
+            input_hash: Hash of input_file the stage ran with
+            input_stamp: Size/mtime stamp of input_file the stage ran with
+            **outputs: Extra provenance, e.g. hash and stamp of produced files
+        """
+        with self._state_lock:
+            self._load_state()[stage] = {
+                "inputs": [str(input_file.relative_to(self.base_dir))],
+                "input_hash": input_hash,
+                "input_stamp": input_stamp,
+                **outputs,
+                "completed_at": datetime.now(timezone.utc).isoformat(
+                    timespec="seconds"
+                ),
+            }
+        self._commit_state()
+
+    def download_file(self, url, filepath):
+        """
+        Download a URL to a file, hashing the content while it streams.
+
+        Gzip transfer encoding is requested and decoded on the fly. Data goes
+        to a temporary file that replaces filepath only once it is complete.
+
+        Returns:
+            BLAKE2b hash of the downloaded file, as get_file_hash computes it
+        """
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        tmp_file = filepath.with_name(filepath.name + ".tmp")
+        digest = hashlib.blake2b(digest_size=16)
+        try:
+            with urllib.request.urlopen(request) as response, open(
+                tmp_file, "wb"
+            ) as out:
+                stream = response
+                if response.headers.get("Content-Encoding") == "gzip":
+                    stream = gzip.GzipFile(fileobj=response)
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+            os.replace(tmp_file, filepath)
+        finally:
+            if tmp_file.exists():
+                tmp_file.unlink()
+        return digest.hexdigest()
+
+    def has_changed(self, stage, filepath):
+        """
+        Check whether a tracked file changed since the stage last ran.
+
+        Size and mtime are compared first; the file is only hashed when they
+        differ. If the content turns out to be the same, the saved stamp is
+        refreshed so the next check takes the fast path again.
+
+        Returns:
+            Tuple (changed, file_hash, file_stamp) for a later record_stage call
+        """
+        saved = self.get_stage_state(stage)
+        saved_hash = saved.get("input_hash")
+        current_stamp = self.get_file_stamp(filepath)
+
+        if saved_hash is not None and current_stamp == saved.get("input_stamp"):
+            return False, saved_hash, current_stamp
+
+        current_hash = self.get_file_hash(filepath)
+        if current_hash == saved_hash:
+            with self._state_lock:
+                saved["input_stamp"] = current_stamp
+            self._commit_state()
+            return False, current_hash, current_stamp
+
+        return True, current_hash, current_stamp
+
+    def _load_input_cached(self):
+        """
+        Load stages/import/input.json, reusing a previous parse when possible.
+
+        Parsed configs are keyed by the file's size and mtime and kept both on
+        the instance and in a pickle sidecar under .cache/, so unchanged input
+        is not parsed again across invocations.
+
+        Returns:
+            Dict with the raw "config", the Overpass "bbox" string and the
+            "translation" type
+        """
+        input_file = self.base_dir / "stages/import/input.json"
+        key = self.get_file_stamp(input_file)
+
+        if key in self._input_cache:
+            return self._input_cache[key]
+
+        cache_file = self.base_dir / ".cache/parsed_input.pkl"
+        try:
+            with open(cache_file, "rb") as f:
+                cached_key, parsed = pickle.load(f)
+            if cached_key == key:
+                self._input_cache[key] = parsed
+                return parsed
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            pass
+
+        with open(input_file, "rb") as f:
+            data = f.read()
+        config = orjson.loads(data) if orjson else json.loads(data)
+
+        start = config["start"]
+        end = config["end"]
+        parsed = {
+            "config": config,
+            "bbox": f"{start['lng']},{end['lat']},{end['lng']},{start['lat']}",
+            "translation": config.get("translation", "linear"),
+        }
+
+        self._input_cache[key] = parsed
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, "wb") as f:
+                pickle.dump((key, parsed), f)
+        except OSError:
+            pass
+
+        return parsed
+
+    def run_parser(self):
+        """
+        Run the building parser, in-process when it can be imported.
+
+        Calling parse_buildings() directly saves the interpreter startup and
+        module imports of a separate python3 process; its output goes through
+        self.log so it does not interleave with concurrently running stages.
+        If the parser module cannot be imported, the script is run as a
+        subprocess instead.
+
+        Returns:
+            True if buildings.json was written successfully
+        """
+        import_dir = self.base_dir / "stages/import"
+
+        try:
+            if str(import_dir) not in sys.path:
+                sys.path.insert(0, str(import_dir))
+            from parse_buildings import parse_buildings
+        except ImportError as e:
+            self.log(f"Building parser not importable ({e}), running it as a script")
+            result = subprocess.run(
+                ["python3", str(import_dir / "parse_buildings.py")],
+                cwd=str(self.base_dir),
+                capture_output=True,
+                text=True,
+            )
+            if result.returncode != 0:
+                self.log(f"Error parsing buildings: {result.stderr}")
+                return False
+            return True
+
+        try:
+            translation_type = self._load_input_cached()["translation"]
+        except (OSError, ValueError, KeyError) as e:
+            self.log(f"Error reading input.json: {e}")
+            translation_type = "linear"
+
+        try:
+            parse_buildings(
+                str(import_dir / "map_data.xml"),
+                str(import_dir / "buildings.json"),
+                str(import_dir / "itc.json"),
+                translation_type,
+                log=self.log,
+            )
+        except SystemExit:
+            # The parser reports its own errors before exiting
+            self.log("Error parsing buildings")
+            return False
+        except Exception as e:
+            self.log(f"Error parsing buildings: {e!r}")
+            return False
+        return True
 
     def run_import(self):
         """Run import stage."""
-        print("Running import stage...")
+        self.log("Running import stage...")
         input_file = self.base_dir / "stages/import/input.json"
 
         if not input_file.exists():
-            print("Error: stages/import/input.json not found")
+            self.log("Error: stages/import/input.json not found")
             return False
 
-        current_hash = self.get_file_hash(input_file)
-        saved_hash = self.get_saved_hash("import")
+        changed, current_hash, current_stamp = self.has_changed("import", input_file)
 
-        if saved_hash != current_hash:
-            print("Input configuration changed, downloading new map data...")
+        if changed:
+            self.log("Input configuration changed, downloading new map data...")
 
             # Read coordinates
-            with open(input_file, "r") as f:
-                config = json.load(f)
-
-            start = config["start"]
-            end = config["end"]
-            bbox = f"{start['lng']},{end['lat']},{end['lng']},{start['lat']}"
+            bbox = self._load_input_cached()["bbox"]
 
             # Download map data
             map_file = self.base_dir / "stages/import/map_data.xml"
             url = f"https://overpass-api.de/api/map?bbox={bbox}"
 
-            result = subprocess.run(
-                ["curl", "-s", url, "-o", str(map_file)], capture_output=True, text=True
-            )
-
-            if result.returncode != 0:
-                print(f"Error downloading map data: {result.stderr}")
+            try:
+                map_hash = self.download_file(url, map_file)
+            except (urllib.error.URLError, OSError) as e:
+                self.log(f"Error downloading map data: {e}")
                 return False
 
-            self.save_hash("import", current_hash)
-            print("✅ Import stage completed")
+            # Record what the import produced so the buildings stage can
+            # check map_data.xml without hashing it again
+            self.record_stage(
+                "import",
+                input_file,
+                current_hash,
+                current_stamp,
+                output_hash=map_hash,
+                output_stamp=self.get_file_stamp(map_file),
+            )
+            self.log("✅ Import stage completed")
             return True
         else:
-            print("✅ Import stage already up to date")
+            self.log("✅ Import stage already up to date")
             return False
 
     def run_buildings(self):
         """Run buildings stage."""
-        print("Running buildings stage...")
+        self.log("Running buildings stage...")
         map_file = self.base_dir / "stages/import/map_data.xml"
 
         if not map_file.exists():
-            print(
+            self.log(
                 "Error: stages/import/map_data.xml not found. Run 'run-stage import' first."
             )
             return False
 
-        current_hash = self.get_file_hash(map_file)
-        saved_hash = self.get_saved_hash("buildings")
-
-        if saved_hash != current_hash:
-            print("Map data changed, parsing buildings...")
+        import_state = self.get_stage_state("import")
+        output_hash = import_state.get("output_hash")
+        output_stamp = import_state.get("output_stamp")
 
-            # Run building parser
-            parser_script = self.base_dir / "stages/import/parse_buildings.py"
-            result = subprocess.run(
-                ["python3", str(parser_script)], capture_output=True, text=True
+        if output_hash is not None and output_stamp == self.get_file_stamp(map_file):
+            # map_data.xml is exactly what the import stage produced
+            current_hash, current_stamp = output_hash, output_stamp
+            changed = current_hash != self.get_stage_state("buildings").get(
+                "input_hash"
+            )
+        else:
+            # No import record for this file (e.g. it was edited by hand)
+            changed, current_hash, current_stamp = self.has_changed(
+                "buildings", map_file
             )
 
-            if result.returncode != 0:
-                print(f"Error parsing buildings: {result.stderr}")
+        if changed:
+            self.log("Map data changed, parsing buildings...")
+
+            # Run building parser
+            if not self.run_parser():
                 return False
 
-            self.save_hash("buildings", current_hash)
-            print("✅ Buildings stage completed")
+            self.record_stage("buildings", map_file, current_hash, current_stamp)
+            self.log("✅ Buildings stage completed")
             return True
         else:
-            print("✅ Buildings stage already up to date")
+            self.log("✅ Buildings stage already up to date")
             return False
 
     def run_backend(self):
         """Run backend stage."""
-        print("Running backend stage...")
+        self.log("Running backend stage...")
         spec_file = self.base_dir / "docs/knowledge/stages/serve_buildings.md"
 
         if not spec_file.exists():
-            print("Error: serve_buildings.md not found")
+            self.log("Error: serve_buildings.md not found")
             return False
 
-        current_hash = self.get_file_hash(spec_file)
-        saved_hash = self.get_saved_hash("serve_buildings")
+        changed, current_hash, current_stamp = self.has_changed(
+            "serve_buildings", spec_file
+        )
 
-        if saved_hash != current_hash:
-            print("API specification changed, building backend...")
+        if changed:
+            self.log("API specification changed, building backend...")
 
             # Install dependencies if needed
             backend_dir = self.base_dir / "stages/serve_buildings"
             node_modules = backend_dir / "node_modules"
 
             if not node_modules.exists():
-                print("Installing dependencies...")
+                self.log("Installing dependencies...")
                 result = subprocess.run(
                     ["npm", "install"],
                     cwd=str(backend_dir),
@@ -143,23 +397,33 @@ class RunStage:
                     text=True,
                 )
                 if result.returncode != 0:
-                    print(f"Error installing dependencies: {result.stderr}")
+                    self.log(f"Error installing dependencies: {result.stderr}")
                     return False
 
-            self.save_hash("serve_buildings", current_hash)
-            print("✅ Backend stage completed - dependencies updated")
+            self.record_stage("serve_buildings", spec_file, current_hash, current_stamp)
+            self.log("✅ Backend stage completed - dependencies updated")
             return True
         else:
-            print("✅ Backend stage already up to date")
+            self.log("✅ Backend stage already up to date")
             return True
 
     def run_all(self):
         """Run all stages."""
-        print("Running complete pipeline...")
-        self.run_import()
-        self.run_buildings()
-        self.run_backend()
-        print("✅ All stages completed")
+        self.log("Running complete pipeline...")
+        # Stages update the build state in memory; it is written once at the end
+        self._defer_state_save = True
+        try:
+            # buildings depends on import; backend only depends on its spec file,
+            # so it runs alongside the import -> buildings chain
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                backend = executor.submit(self.run_backend)
+                self.run_import()
+                self.run_buildings()
+                backend.result()
+        finally:
+            self._defer_state_save = False
+            self._save_state()
+        self.log("✅ All stages completed")
 
 
 def main():
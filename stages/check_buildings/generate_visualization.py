@@ -1,7 +1,30 @@
+import gzip
 import json
+import math
 import random
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Polygon data loaded by index.html at runtime, next to this script
+DATA_FILE_NAME = "buildings.min.json"
+
+
+def _write_with_gzip(path, content):
+    """Write bytes to path and a pre-compressed copy to path + ".gz"."""
+    with open(path, "wb") as f:
+        f.write(content)
+    with gzip.open(f"{path}.gz", "wb", compresslevel=6) as f:
+        f.write(content)
+
 
 def generate_buildings_visualization():
     """Generate HTML with SVG visualization of imported buildings."""
@@ -11,8 +34,9 @@ def generate_buildings_visualization():
 
     # Read buildings data
     try:
-        with open(buildings_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(buildings_path, "rb") as f:
+            content = f.read()
+        data = orjson.loads(content) if orjson else json.loads(content)
         buildings = data.get("buildings", [])
         print(f"Loaded {len(buildings)} buildings")
     except Exception as e:
@@ -23,65 +47,66 @@ def generate_buildings_visualization():
         print("No buildings found to visualize")
         return
 
-    # Calculate overall bounds for SVG viewBox
-    all_coords = []
+    # Keep coordinates as per-building x/z arrays instead of per-node dicts,
+    # tracking the overall bounds for SVG viewBox in the same pass
+    min_x = min_z = math.inf
+    max_x = max_z = -math.inf
     for building in buildings:
-        for node in building.get("nodes", []):
-            all_coords.append(node)
+        nodes = building.pop("nodes", None) or []
+        xs = building["xs"] = [node["x"] for node in nodes]
+        zs = building["zs"] = [node["z"] for node in nodes]
+        if xs:
+            min_x = min(min_x, min(xs))
+            max_x = max(max_x, max(xs))
+            min_z = min(min_z, min(zs))
+            max_z = max(max_z, max(zs))
 
-    if not all_coords:
+    if min_x == math.inf:
         print("No coordinates found in buildings")
         return
 
-    # Calculate bounds
-    x_coords = [coord["x"] for coord in all_coords]
-    z_coords = [coord["z"] for coord in all_coords]
-
-    min_x, max_x = min(x_coords), max(x_coords)
-    min_z, max_z = min(z_coords), max(z_coords)
-
     # Add some padding
     padding = 50
     view_box = f"{min_x - padding} {min_z - padding} {max_x - min_x + 2 * padding} {max_z - min_z + 2 * padding}"
 
     # Generate random colors for buildings
-    colors = []
-    for _ in range(len(buildings)):
-        # Generate pleasant colors (avoid too dark/light)
-        r = random.randint(50, 200)
-        g = random.randint(50, 200)
-        b = random.randint(50, 200)
-        colors.append(f"rgb({r},{g},{b})")
-
-    # Generate SVG polygons
-    svg_polygons = []
+    # Pleasant colors only (avoid too dark/light): channels in 50..200
+    if np is not None:
+        rgb = np.random.randint(50, 201, size=(len(buildings), 3)).tolist()
+    else:
+        rgb = [
+            (random.randint(50, 200), random.randint(50, 200), random.randint(50, 200))
+            for _ in range(len(buildings))
+        ]
+    colors = [f"rgb({r},{g},{b})" for r, g, b in rgb]
+
+    # Collect polygon data; index.html turns it into SVG polygons on load
+    polygons = []
     for i, building in enumerate(buildings):
-        nodes = building.get("nodes", [])
-        if len(nodes) < 3:  # Need at least 3 points for a polygon
+        xs = building["xs"]
+        if len(xs) < 3:  # Need at least 3 points for a polygon
             continue
 
-        # Create polygon points string
-        points = " ".join([f"{node['x']},{node['z']}" for node in nodes])
-
-        # Get building info for tooltip
-        address = building.get("address", "No address")
-        height = building.get("height", "Unknown")
-        building_id = building.get("id", "Unknown")
-
-        polygon = f'''
-        <polygon
-            points="{points}"
-            fill="{colors[i]}"
-            fill-opacity="0.7"
-            stroke="black"
-            stroke-width="2"
-            data-address="{address}"
-            data-height="{height}"
-            data-id="{building_id}"
-            onmouseover="showBuildingInfo(this)"
-            onmouseout="hideBuildingInfo()"
-        />'''
-        svg_polygons.append(polygon)
+        polygons.append(
+            {
+                "id": building.get("id", "Unknown"),
+                # Create polygon points string
+                "points": " ".join(f"{x},{z}" for x, z in zip(xs, building["zs"])),
+                "color": colors[i],
+                # Building info for tooltip
+                "address": building.get("address", "No address"),
+                "height": building.get("height", "Unknown"),
+            }
+        )
+
+    # viewBox and stats are baked into index.html, so only polygons are loaded
+    polygon_data = {"buildings": polygons}
+    if orjson:
+        data_content = orjson.dumps(polygon_data)
+    else:
+        data_content = json.dumps(
+            polygon_data, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
 
     # Generate HTML content
     html_content = f'''<!DOCTYPE html>
@@ -180,9 +205,7 @@ def generate_buildings_visualization():
             </div>
         </div>
 
-        <svg viewBox="{view_box}" preserveAspectRatio="xMidYMid meet">
-            {"".join(svg_polygons)}
-        </svg>
+        <svg id="buildings" viewBox="{view_box}" preserveAspectRatio="xMidYMid meet"></svg>
 
         <div class="legend">
             <p>Each color represents a different building. Buildings are randomly colored for better visual distinction.</p>
@@ -192,6 +215,35 @@ def generate_buildings_visualization():
     <div id="buildingInfo" class="building-info"></div>
 
     <script>
+        const SVG_NS = 'http://www.w3.org/2000/svg';
+
+        async function loadBuildings() {{
+            const svg = document.getElementById('buildings');
+            try {{
+                const response = await fetch('{DATA_FILE_NAME}');
+                const data = await response.json();
+
+                const fragment = document.createDocumentFragment();
+                for (const building of data.buildings) {{
+                    const polygon = document.createElementNS(SVG_NS, 'polygon');
+                    polygon.setAttribute('points', building.points);
+                    polygon.setAttribute('fill', building.color);
+                    polygon.setAttribute('fill-opacity', '0.7');
+                    polygon.setAttribute('stroke', 'black');
+                    polygon.setAttribute('stroke-width', '2');
+                    polygon.setAttribute('data-address', building.address || '');
+                    polygon.setAttribute('data-height', building.height);
+                    polygon.setAttribute('data-id', building.id);
+                    polygon.addEventListener('mouseover', () => showBuildingInfo(polygon));
+                    polygon.addEventListener('mouseout', hideBuildingInfo);
+                    fragment.appendChild(polygon);
+                }}
+                svg.appendChild(fragment);
+            }} catch (error) {{
+                console.error('Error loading {DATA_FILE_NAME}:', error);
+            }}
+        }}
+
         function showBuildingInfo(element) {{
             const address = element.getAttribute('data-address');
             const height = element.getAttribute('data-height');
@@ -227,19 +279,25 @@ def generate_buildings_visualization():
                 hideBuildingInfo();
             }}
         }});
+
+        loadBuildings();
     </script>
 </body>
 </html>'''
 
-    # Write HTML file
-    output_path = Path(__file__).parent / "index.html"
+    # Write polygon data and HTML files
+    output_dir = Path(__file__).parent
+    output_path = output_dir / "index.html"
     try:
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
+        _write_with_gzip(output_dir / DATA_FILE_NAME, data_content)
+        _write_with_gzip(output_path, html_content.encode("utf-8"))
         print(f"Visualization generated: {output_path}")
-        print(f"Open this file in a web browser to view the buildings")
+        print(
+            "Serve this directory over HTTP (python3 -m http.server) and open "
+            "index.html in a web browser to view the buildings"
+        )
     except Exception as e:
-        print(f"Error writing HTML file: {e}")
+        print(f"Error writing visualization files: {e}")
 
 
 if __name__ == "__main__":
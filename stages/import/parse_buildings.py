@@ -1,88 +1,368 @@
 import json
 import math
 import sys
-import xml.etree.ElementTree as ET
-from typing import Any, Dict, List
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
+try:
+    from lxml import etree as ET
 
-def lat_lng_to_mercator(lat: float, lng: float) -> List[float]:
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+    HAS_LXML = False
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Top-level OSM elements handled (or at least discarded) while streaming
+OSM_TAGS = ("bounds", "node", "way", "relation")
+
+
+def _make_linear(
+    bounds: Dict[str, float]
+) -> Callable[[float, float], Tuple[float, float]]:
     """
-    Convert latitude and longitude to Mercator projection coordinates.
+    Build a linear transformation normalizing coordinates to 0-1000 range.
 
     Args:
-        lat: Latitude coordinate in degrees
-        lng: Longitude coordinate in degrees
+        bounds: Dictionary with minlat, maxlat, minlon, maxlon from XML bounds
+
+    Returns:
+        Function (lat, lng) -> (x, z) with the scale factors precomputed
+    """
+    minlat = bounds["minlat"]
+    minlon = bounds["minlon"]
+    kx = 1000.0 / (bounds["maxlon"] - minlon)
+    kz = 1000.0 / (bounds["maxlat"] - minlat)
+
+    def linear(lat: float, lng: float) -> Tuple[float, float]:
+        return (lng - minlon) * kx, (lat - minlat) * kz
+
+    return linear
+
+
+def _make_mercator() -> Callable[[float, float], Tuple[float, float]]:
+    """
+    Build a Mercator projection with its constants bound locally.
 
     Returns:
-        Dict {"x": x, "z": z} coordinates in Mercator projection
+        Function (lat, lng) -> (x, z) in Mercator projection
     """
-    # Convert to radians
-    lat_rad = math.radians(lat)
-    lng_rad = math.radians(lng)
+    radians = math.radians
+    log = math.log
+    tan = math.tan
+    pi_4 = math.pi / 4
 
-    # Mercator projection formulas
-    x = lng_rad
-    z = math.log(math.tan(math.pi / 4 + lat_rad / 2))
+    def mercator(lat: float, lng: float) -> Tuple[float, float]:
+        return radians(lng), log(tan(pi_4 + radians(lat) / 2))
 
-    return {"x": x, "z": z}
+    return mercator
 
 
-def lat_lng_to_linear(lat: float, lng: float, bounds: Dict[str, float]) -> List[float]:
+def _make_transform(
+    translation_type: str, bounds: Dict[str, float]
+) -> Callable[[float, float], Tuple[float, float]]:
     """
-    Convert latitude and longitude to linear normalized coordinates.
+    Pick a specialized per-point transformation for a translation type.
 
     Args:
-        lat: Latitude coordinate
-        lng: Longitude coordinate
-        bounds: Dictionary with minlat, maxlat, minlon, maxlon from XML bounds
+        translation_type: Type of transformation ("none", "mercator", "linear")
+        bounds: Dictionary with bounds for linear transformation
 
     Returns:
-        Dict {"x": x, "z": z} coordinates normalized to 0-1000 range
+        Function (lat, lng) -> (x, z)
     """
-    minlat = bounds["minlat"]
-    maxlat = bounds["maxlat"]
-    minlon = bounds["minlon"]
-    maxlon = bounds["maxlon"]
+    if translation_type == "none":
+        return lambda lat, lng: (lng, lat)  # Keep as lat/lng
+    elif translation_type == "mercator":
+        return _make_mercator()
+    else:
+        # "linear", and the default for unknown types
+        return _make_linear(bounds)
 
-    # Normalize coordinates to 0-1 range
-    normalized_x = (lng - minlon) / (maxlon - minlon)
-    normalized_z = (lat - minlat) / (maxlat - minlat)
 
-    # Scale to reasonable values
-    x = normalized_x * 1000
-    z = normalized_z * 1000
+def mercator_batch(lats: "np.ndarray", lngs: "np.ndarray") -> Tuple[Any, Any]:
+    """
+    Vectorized Mercator projection (see _make_mercator) over coordinate arrays.
 
-    return {"x": x, "z": z}
+    Args:
+        lats: Latitude coordinates in degrees
+        lngs: Longitude coordinates in degrees
+
+    Returns:
+        Tuple of (x, z) arrays in Mercator projection
+    """
+    x = np.radians(lngs)
+    z = np.log(np.tan(np.pi / 4 + np.radians(lats) / 2))
+    return x, z
 
 
-def transform_coordinates(
-    lat: float, lng: float, translation_type: str, bounds: Dict[str, float]
-) -> List[float]:
+def linear_batch(
+    lats: "np.ndarray", lngs: "np.ndarray", bounds: Dict[str, float]
+) -> Tuple[Any, Any]:
     """
-    Transform coordinates based on translation type.
+    Vectorized linear transformation (see _make_linear) over coordinate arrays.
 
     Args:
-        lat: Latitude coordinate
-        lng: Longitude coordinate
+        lats: Latitude coordinates
+        lngs: Longitude coordinates
+        bounds: Dictionary with minlat, maxlat, minlon, maxlon from XML bounds
+
+    Returns:
+        Tuple of (x, z) arrays normalized to 0-1000 range
+    """
+    kx = 1000.0 / (bounds["maxlon"] - bounds["minlon"])
+    kz = 1000.0 / (bounds["maxlat"] - bounds["minlat"])
+    x = (lngs - bounds["minlon"]) * kx
+    z = (lats - bounds["minlat"]) * kz
+    return x, z
+
+
+def transform_coordinates_batch(
+    lats: Sequence[float],
+    lngs: Sequence[float],
+    translation_type: str,
+    bounds: Dict[str, float],
+) -> Tuple[List[float], List[float]]:
+    """
+    Transform many coordinates at once based on translation type.
+
+    Uses NumPy when it is installed and falls back to a transformation
+    specialized by _make_transform per point otherwise.
+
+    Args:
+        lats: Latitude coordinates
+        lngs: Longitude coordinates
         translation_type: Type of transformation ("none", "mercator", "linear")
         bounds: Dictionary with bounds for linear transformation
 
     Returns:
-        Dict {"x": x, "z": z} transformed coordinates
+        Tuple of (x, z) lists of transformed coordinates
     """
+    if not lats:
+        # Nothing to transform; also keeps zero-span bounds from dividing
+        return [], []
+
+    if np is None:
+        transform = _make_transform(translation_type, bounds)
+        xs = []
+        zs = []
+        for lat, lng in zip(lats, lngs):
+            x, z = transform(lat, lng)
+            xs.append(x)
+            zs.append(z)
+        return xs, zs
+
+    lat_arr = np.asarray(lats, dtype=np.float64)
+    lng_arr = np.asarray(lngs, dtype=np.float64)
+
     if translation_type == "none":
-        return {"x": lng, "z": lat}  # Keep as lat/lng
+        x, z = lng_arr, lat_arr
     elif translation_type == "mercator":
-        return lat_lng_to_mercator(lat, lng)
-    elif translation_type == "linear":
-        return lat_lng_to_linear(lat, lng, bounds)
+        x, z = mercator_batch(lat_arr, lng_arr)
     else:
-        # Default to linear if unknown type
-        return lat_lng_to_linear(lat, lng, bounds)
+        # "linear", and the default for unknown types
+        x, z = linear_batch(lat_arr, lng_arr, bounds)
+
+    return x.tolist(), z.tolist()
+
+
+def _iter_osm_elements(xml_file_path: str) -> Iterator[Any]:
+    """
+    Stream closed top-level OSM elements from an XML file.
+
+    Each element is cleared and detached from the tree once the caller is done
+    with it, so memory does not grow with the file. With lxml the tag filter
+    runs inside libxml2 and nested tag/nd elements never produce events.
+
+    Args:
+        xml_file_path: Path to the input XML file
+
+    Yields:
+        Closed bounds, node, way and relation elements in document order
+    """
+    if HAS_LXML:
+        for _, elem in ET.iterparse(xml_file_path, events=("end",), tag=OSM_TAGS):
+            yield elem
+            elem.clear()
+            # Delete already handled siblings still referenced by the root
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
+        return
+
+    root = None
+    for event, elem in ET.iterparse(xml_file_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+        elif elem.tag in OSM_TAGS:
+            yield elem
+            # Drop the processed subtree and detach it from the root
+            elem.clear()
+            root.clear()
+
+
+def _tag_building(state: Dict[str, Any], v: Optional[str]) -> None:
+    """Mark the way as a building."""
+    state["is_building"] = True
+
+
+def _tag_street(state: Dict[str, Any], v: Optional[str]) -> None:
+    """Store the addr:street value."""
+    state["street"] = v
+
+
+def _tag_housenumber(state: Dict[str, Any], v: Optional[str]) -> None:
+    """Store the addr:housenumber value."""
+    state["housenumber"] = v
+
+
+def _tag_height(state: Dict[str, Any], v: Optional[str]) -> None:
+    """Store the height value if it is a valid number."""
+    try:
+        state["height"] = float(v)
+    except (ValueError, TypeError):
+        pass
+
+
+def _tag_building_levels(state: Dict[str, Any], v: Optional[str]) -> None:
+    """Store the building:levels value if it is a valid number."""
+    try:
+        state["building_levels"] = float(v)
+    except (ValueError, TypeError):
+        pass
+
+
+# Handlers for the way tags we care about, keyed by tag name; each one
+# updates the per-way state built in _process_way
+_TAG_HANDLERS: Dict[str, Callable[[Dict[str, Any], Optional[str]], None]] = {
+    "building": _tag_building,
+    "addr:street": _tag_street,
+    "addr:housenumber": _tag_housenumber,
+    "height": _tag_height,
+    "building:levels": _tag_building_levels,
+}
+
+
+def _process_way(
+    way: Any, nodes_dict: Dict[str, int]
+) -> Tuple[Optional[Dict[str, Any]], Optional[str], List[int]]:
+    """
+    Build a building object from a way element.
+
+    Node coordinates are not filled in here; the rows of the referenced nodes
+    are returned instead so all of them can be transformed in one batch.
+
+    Args:
+        way: Closed way element with its tag and nd children
+        nodes_dict: Coordinate row of each node collected so far, keyed by id
+
+    Returns:
+        Tuple of the building object (None if the way is not a building),
+        its house number and the coordinate rows of its nodes
+    """
+    way_id = way.get("id")
+    if not way_id:
+        return None, None, []
+
+    # Check tags for building information in a single pass
+    state = {
+        "is_building": False,
+        "street": None,
+        "housenumber": None,
+        "height": None,
+        "building_levels": None,
+    }
+    for tag in way.iter("tag"):
+        attrib = tag.attrib
+        handler = _TAG_HANDLERS.get(attrib.get("k"))
+        if handler is not None:
+            handler(state, attrib.get("v"))
+
+    # Most ways are roads, fences and the like; skip their nodes entirely
+    if not state["is_building"]:
+        return None, None, []
+
+    # Get coordinate rows of all nodes for this way
+    rows = []
+    for nd in way.iter("nd"):
+        ref = nd.get("ref")
+        if ref and ref in nodes_dict:
+            rows.append(nodes_dict[ref])
+
+    street = state["street"]
+    housenumber = state["housenumber"]
+    height = state["height"]
+    building_levels = state["building_levels"]
+
+    # Build address string
+    address_parts = []
+    if street:
+        address_parts.append(street)
+    if housenumber:
+        address_parts.append(housenumber)
+    address = ", ".join(address_parts) if address_parts else None
+
+    # Calculate height
+    if height is not None:
+        # Use direct height value if available
+        final_height = height
+    elif building_levels is not None:
+        # Calculate height from building levels (3 meters per floor)
+        final_height = building_levels * 3
+    else:
+        # Default height of 3 meters
+        final_height = 3
+
+    # Create building object
+    building_obj = {
+        "id": way_id,
+        "nodes": [],
+        "address": address,
+        "height": final_height,
+    }
+
+    return building_obj, housenumber, rows
+
+
+def _write_json(file_path: str, data: Dict[str, Any], pretty: bool = False) -> None:
+    """
+    Write data to a UTF-8 JSON file, using orjson when it is installed.
+
+    Args:
+        file_path: Path to the output JSON file
+        data: JSON-serializable data
+        pretty: Indent the output instead of writing compact JSON
+    """
+    if orjson is None:
+        with open(file_path, "w", encoding="utf-8") as f:
+            if pretty:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            else:
+                json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+        return
+
+    with open(file_path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else None))
 
 
 def parse_buildings(
-    xml_file_path: str, output_file_path: str, itc_file_path: str, translation_type: str
+    xml_file_path: str,
+    output_file_path: str,
+    itc_file_path: str,
+    translation_type: str,
+    pretty: bool = False,
+    log: Callable[[str], None] = print,
 ) -> None:
     """
     Parse OpenStreetMap XML data and extract building information.
@@ -92,176 +372,135 @@ def parse_buildings(
         output_file_path: Path to the output JSON file
         itc_file_path: Path to the ITC coordinates JSON file
         translation_type: Type of coordinate transformation
+        pretty: Write indented JSON files instead of compact ones
+        log: Function receiving each progress/status line (print by default)
     """
 
-    # Parse the XML file
+    # Bounds are read from the stream before any node or way is processed
+    bounds = None
+
+    # Node id -> row in the lats/lons coordinate arrays
+    nodes_dict = {}
+    lats = array("d")
+    lons = array("d")
+    buildings = []
+    building_rows = []
+    itc_building = None
+    itc_rows = []
+
+    # Single streaming pass: nodes and ways are handled as their elements close
+    # and discarded right away, so memory stays proportional to the buildings
+    # rather than to the whole XML file
+    log("Collecting nodes and processing building ways...")
     try:
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
+        for elem in _iter_osm_elements(xml_file_path):
+            if elem.tag == "bounds":
+                bounds = {
+                    "minlat": float(elem.get("minlat", 0)),
+                    "maxlat": float(elem.get("maxlat", 0)),
+                    "minlon": float(elem.get("minlon", 0)),
+                    "maxlon": float(elem.get("maxlon", 0)),
+                }
+
+                log(
+                    f"Map bounds: minlat={bounds['minlat']}, maxlat={bounds['maxlat']}, "
+                    f"minlon={bounds['minlon']}, maxlon={bounds['maxlon']}"
+                )
+                log(f"Using translation type: {translation_type}")
+
+            elif elem.tag == "node":
+                node_id = elem.get("id")
+                if node_id:
+                    nodes_dict[node_id] = len(lats)
+                    lats.append(float(elem.get("lat", 0)))
+                    lons.append(float(elem.get("lon", 0)))
+
+            elif elem.tag == "way":
+                if bounds is None:
+                    log("Error: No bounds element found in XML")
+                    sys.exit(1)
+
+                building_obj, housenumber, rows = _process_way(elem, nodes_dict)
+                if building_obj is not None:
+                    buildings.append(building_obj)
+                    building_rows.append(rows)
+
+                    # Check if this is the ITC building (Чкалова, 3)
+                    address = building_obj["address"]
+                    if address and "Чкалова" in address and housenumber == "3":
+                        itc_building = building_obj
+                        itc_rows = rows
+                        log(f"Found ITC building: {address}")
     except ET.ParseError as e:
-        print(f"Error parsing XML file: {e}")
+        log(f"Error parsing XML file: {e}")
         sys.exit(1)
     except FileNotFoundError:
-        print(f"XML file not found: {xml_file_path}")
+        log(f"XML file not found: {xml_file_path}")
         sys.exit(1)
 
-    # Get bounds from XML for coordinate transformation
-    bounds_element = root.find("bounds")
-    if bounds_element is None:
-        print("Error: No bounds element found in XML")
+    if bounds is None:
+        log("Error: No bounds element found in XML")
         sys.exit(1)
 
-    bounds = {
-        "minlat": float(bounds_element.get("minlat", 0)),
-        "maxlat": float(bounds_element.get("maxlat", 0)),
-        "minlon": float(bounds_element.get("minlon", 0)),
-        "maxlon": float(bounds_element.get("maxlon", 0)),
-    }
-
-    print(
-        f"Map bounds: minlat={bounds['minlat']}, maxlat={bounds['maxlat']}, "
-        f"minlon={bounds['minlon']}, maxlon={bounds['maxlon']}"
+    log(f"Collected {len(nodes_dict)} nodes")
+
+    # Only nodes referenced by a building are transformed, each one once
+    # however many buildings share it; positions maps a node row to its
+    # index in the transformed arrays
+    positions = {}
+    for rows in building_rows:
+        for row in rows:
+            if row not in positions:
+                positions[row] = len(positions)
+
+    xs, zs = transform_coordinates_batch(
+        [lats[row] for row in positions],
+        [lons[row] for row in positions],
+        translation_type,
+        bounds,
     )
-    print(f"Using translation type: {translation_type}")
-
-    # Create dictionaries to store nodes and ways
-    nodes_dict = {}
-    buildings = []
-    itc_building = None
-
-    # First pass: collect all nodes
-    print("Collecting nodes...")
-    for node in root.findall("node"):
-        node_id = node.get("id")
-        if node_id:
-            nodes_dict[node_id] = {
-                "lat": float(node.get("lat", 0)),
-                "lon": float(node.get("lon", 0)),
-            }
-
-    print(f"Collected {len(nodes_dict)} nodes")
-
-    # Second pass: process ways that are buildings
-    print("Processing building ways...")
-    for way in root.findall("way"):
-        way_id = way.get("id")
-        if not way_id:
-            continue
-
-        # Check if this way is a building
-        is_building = False
-        street = None
-        housenumber = None
-        height = None
-        building_levels = None
-
-        # Check tags for building information
-        for tag in way.findall("tag"):
-            k = tag.get("k")
-            v = tag.get("v")
-
-            if k == "building":
-                is_building = True
-            elif k == "addr:street":
-                street = v
-            elif k == "addr:housenumber":
-                housenumber = v
-            elif k == "height":
-                try:
-                    height = float(v)
-                except (ValueError, TypeError):
-                    pass
-            elif k == "building:levels":
-                try:
-                    building_levels = float(v)
-                except (ValueError, TypeError):
-                    pass
-
-        # If it's a building, process it
-        if is_building:
-            # Get all node coordinates for this way
-            nodes = []
-            for nd in way.findall("nd"):
-                ref = nd.get("ref")
-                if ref and ref in nodes_dict:
-                    node_data = nodes_dict[ref]
-                    # Transform coordinates based on translation type
-                    xz_coords = transform_coordinates(
-                        node_data["lat"], node_data["lon"], translation_type, bounds
-                    )
-                    # Invert X coordinate to fix mirroring issue
-                    xz_coords["x"] = -xz_coords["x"]
-                    nodes.append(xz_coords)
-
-            # Build address string
-            address_parts = []
-            if street:
-                address_parts.append(street)
-            if housenumber:
-                address_parts.append(housenumber)
-            address = ", ".join(address_parts) if address_parts else None
-
-            # Calculate height
-            if height is not None:
-                # Use direct height value if available
-                final_height = height
-            elif building_levels is not None:
-                # Calculate height from building levels (3 meters per floor)
-                final_height = building_levels * 3
-            else:
-                # Default height of 3 meters
-                final_height = 3
+    # Invert X coordinate to fix mirroring issue
+    xs = [-x for x in xs]
 
-            # Create building object
-            building_obj = {
-                "id": way_id,
-                "nodes": nodes,
-                "address": address,
-                "height": final_height,
-            }
+    for building_obj, rows in zip(buildings, building_rows):
+        nodes = building_obj["nodes"]
+        for row in rows:
+            position = positions[row]
+            nodes.append({"x": xs[position], "z": zs[position]})
 
-            buildings.append(building_obj)
-
-            # Check if this is the ITC building (Чкалова, 3)
-            if address and "Чкалова" in address and housenumber == "3":
-                itc_building = building_obj
-                print(f"Found ITC building: {address}")
-
-    print(f"Found {len(buildings)} buildings")
+    log(f"Found {len(buildings)} buildings")
 
     # Save buildings to JSON file
     output_data = {"buildings": buildings}
 
     try:
-        with open(output_file_path, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-        print(f"Building data saved to {output_file_path}")
+        _write_json(output_file_path, output_data, pretty)
+        log(f"Building data saved to {output_file_path}")
     except IOError as e:
-        print(f"Error writing JSON file: {e}")
+        log(f"Error writing JSON file: {e}")
         sys.exit(1)
 
     # Save ITC coordinates if found
     if itc_building:
         # Calculate center coordinates (average of all nodes)
-        nodes = itc_building["nodes"]
-        if nodes:
-            center_x = sum(node["x"] for node in nodes) / len(nodes)
-            center_z = sum(node["z"] for node in nodes) / len(nodes)
+        if itc_rows:
+            itc_positions = [positions[row] for row in itc_rows]
+            center_x = sum(xs[p] for p in itc_positions) / len(itc_positions)
+            center_z = sum(zs[p] for p in itc_positions) / len(itc_positions)
             # Note: X coordinate is already inverted at import level
 
             itc_data = {"center": {"x": center_x, "z": center_z}}
 
             try:
-                with open(itc_file_path, "w", encoding="utf-8") as f:
-                    json.dump(itc_data, f, indent=2, ensure_ascii=False)
-                print(f"ITC coordinates saved to {itc_file_path}")
-                print(f"ITC center coordinates: [{center_x:.2f}, {center_z:.2f}]")
+                _write_json(itc_file_path, itc_data, pretty)
+                log(f"ITC coordinates saved to {itc_file_path}")
+                log(f"ITC center coordinates: [{center_x:.2f}, {center_z:.2f}]")
             except IOError as e:
-                print(f"Error writing ITC JSON file: {e}")
+                log(f"Error writing ITC JSON file: {e}")
         else:
-            print("Warning: ITC building has no nodes, cannot calculate center")
+            log("Warning: ITC building has no nodes, cannot calculate center")
     else:
-        print("Warning: ITC building (Чкалова, 3) not found")
+        log("Warning: ITC building (Чкалова, 3) not found")
 
 
 def main():
@@ -272,15 +511,19 @@ def main():
 
     # Read translation type from input.json
     try:
-        with open("stages/import/input.json", "r", encoding="utf-8") as f:
-            input_config = json.load(f)
+        with open("stages/import/input.json", "rb") as f:
+            data = f.read()
+        input_config = orjson.loads(data) if orjson else json.loads(data)
         translation_type = input_config.get("translation", "linear")
     except (FileNotFoundError, json.JSONDecodeError) as e:
         print(f"Error reading input.json: {e}")
         translation_type = "linear"
 
     print(f"Parsing buildings from {input_file}...")
-    parse_buildings(input_file, output_file, itc_file, translation_type)
+    # Output is machine-read downstream; --pretty indents it for debugging
+    pretty = "--pretty" in sys.argv[1:]
+
+    parse_buildings(input_file, output_file, itc_file, translation_type, pretty)
 
 
 if __name__ == "__main__":